@@ -1,12 +1,15 @@
 import asyncio
-from simple_supervisor import simple_supervisor
+from simple_supervisor import simple_supervisor, close_browser
 
 async def main():
     """
     Main function that runs the simplified supervisor agent.
     """
     print("Starting simplified supervisor agent...")
-    await simple_supervisor()
+    try:
+        await simple_supervisor()
+    finally:
+        await close_browser()
     print("Supervisor completed.")
 
 if __name__ == "__main__":
@@ -6,7 +6,7 @@ import re
 from typing import List, Dict, Tuple, Optional, Union
 from playwright.async_api import Page
 from agents import Agent, Runner
-from openai import OpenAI
+from shared import get_client
 
 # This Agent is used as a fallback method for CAPTCHA solving
 # It's only invoked in the get_multiple_captcha_solutions method which is UNUSED in the main flow
@@ -16,6 +16,22 @@ from openai import OpenAI
 #     model="gpt-4o"
 # )
 
+# Markers that show we're still on a CAPTCHA page. Matching case-insensitively searches
+# the page HTML as-is, without making a lowercased copy of it.
+STILL_CAPTCHA_RE = re.compile(r"captcha|robot check", re.IGNORECASE)
+
+# The letters image on Amazon's robot-check page
+CAPTCHA_IMAGE_SELECTOR = "form[action*='validateCaptcha'] img, img[src*='captcha']"
+
+# Images larger than this are base64-encoded in a worker thread so the event loop isn't blocked
+BASE64_THREAD_THRESHOLD = 64 * 1024
+
+async def encode_base64(data: bytes) -> str:
+    """Base64-encodes data, off the event loop for large payloads."""
+    if len(data) > BASE64_THREAD_THRESHOLD:
+        return await asyncio.to_thread(lambda: base64.b64encode(data).decode("ascii"))
+    return base64.b64encode(data).decode("ascii")
+
 async def solve_captcha(page: Page) -> Dict:
     """
     Main CAPTCHA solver function that orchestrates the entire process:
@@ -30,13 +46,19 @@ async def solve_captcha(page: Page) -> Dict:
     - success: whether the CAPTCHA was successfully solved
     - message: a user-friendly message about the result
     """
-    # Wait for the page to fully load before proceeding
-    await page.wait_for_load_state("networkidle")
+    # Wait for the page to load before proceeding. Amazon keeps beacons open, so
+    # "networkidle" would usually just run into the timeout.
+    await page.wait_for_load_state("domcontentloaded", timeout=10000)
     print("Page loaded, analyzing for CAPTCHA...")
     
-    # Capture the CAPTCHA image for processing
-    screenshot_bytes = await page.screenshot(full_page=True)
-    screenshot_base64 = base64.b64encode(screenshot_bytes).decode("utf-8")
+    # Capture the CAPTCHA image for processing. Crop to the CAPTCHA image itself when it can
+    # be found, otherwise take the viewport (the CAPTCHA sits at the top of the page). PNG
+    # is kept so OCR sees lossless letters; the crop is what keeps the payload small.
+    try:
+        screenshot_bytes = await page.locator(CAPTCHA_IMAGE_SELECTOR).first.screenshot(timeout=2000)
+    except Exception:
+        screenshot_bytes = await page.screenshot(full_page=False)
+    screenshot_base64 = await encode_base64(screenshot_bytes)
     
     # PRIMARY METHOD: Get CAPTCHA text using the simplified approach
     # This is the main flow - other methods like get_multiple_captcha_solutions are not used
@@ -126,7 +148,11 @@ async def solve_captcha(page: Page) -> Dict:
             # Silent error - will try next approach
             pass
     
-    # PHASE 4: Submit the form
+    # PHASE 4: Submit the form. Start listening for the main-frame navigation first so
+    # the wait below can't miss it.
+    navigation = asyncio.ensure_future(page.wait_for_event(
+        "framenavigated", predicate=lambda frame: frame == page.main_frame, timeout=10000
+    ))
     if submit_button:
         try:
             # Method 1: Direct click
@@ -144,21 +170,24 @@ async def solve_captcha(page: Page) -> Dict:
         await page.keyboard.press("Enter")
     
     # PHASE 5: Wait for the form submission to process
-    # This delay allows the page to transition after submission
-    await asyncio.sleep(2)
+    # Returns as soon as the submission navigates and the new page's DOM is ready,
+    # instead of sleeping for a fixed time
+    try:
+        await navigation
+        await page.wait_for_load_state("domcontentloaded", timeout=10000)
+    except Exception:
+        print("No navigation after CAPTCHA submission")
     
     # PHASE 6: Verify if we solved the CAPTCHA successfully
     # Check multiple indicators to see if we're still on the CAPTCHA page
     current_url = page.url
-    current_title = await page.title()
-    current_content = await page.content()
+    current_title, current_content = await asyncio.gather(page.title(), page.content())
     
     # If any of these indicators are present, we're still on a CAPTCHA page
     still_captcha = (
         "captcha" in current_url.lower() or
         "robot check" in current_title.lower() or
-        "captcha" in current_content.lower() or
-        "robot check" in current_content.lower()
+        STILL_CAPTCHA_RE.search(current_content) is not None
     )
     
     # Return a detailed result dictionary
@@ -175,12 +204,12 @@ async def simple_captcha_solve(image_base64: str) -> str:
     
     This is the MAIN method used in the current workflow.
     """
-    client = OpenAI()
+    client = get_client()
     
     try:
         # Use GPT-4o with vision capabilities to interpret the CAPTCHA
         # The prompt specifically mentions Amazon CAPTCHAs only use letters, not numbers
-        response = client.chat.completions.create(
+        response = await client.chat.completions.create(
             model="gpt-4o",
             messages=[
                 {
@@ -1,10 +1,10 @@
 import asyncio
-import base64
 import json
+from pathlib import Path
 from typing import Optional, Dict, Any
 from playwright.async_api import Page, TimeoutError
-from openai import OpenAI
 from agents import Agent, Runner, function_tool
+from shared import get_client, get_cdp_session, model_reports_done, capture_screenshot
 
 class InputDict(dict):
     def to_input_item(self):
@@ -30,7 +30,7 @@ async def mango_finder_agent(page: Page, search_method: str = "auto") -> Dict[st
             print("Already on Amazon, determining best search method...")
             # Check if we have the OpenAI API key available for CUA
             try:
-                client = OpenAI()
+                client = get_client()
                 search_method = "cua"  # Default to CUA if OpenAI client works
             except Exception as e:
                 print(f"OpenAI client error: {e}, falling back to manual search")
@@ -47,24 +47,28 @@ async def mango_finder_agent(page: Page, search_method: str = "auto") -> Dict[st
 
 async def search_with_cua(page: Page) -> Dict[str, Any]:
     """Use the Computer-Using Agent to search for mango slices on Amazon."""
-    client = OpenAI()
+    client = get_client()
     
     print("Starting Mango Finder with CUA model...")
     
+    # The tools payload doesn't change during the loop, so build it once
+    viewport = page.viewport_size
+    tools = [{
+        "type": "computer_use_preview",
+        "display_width": int(viewport["width"]),
+        "display_height": int(viewport["height"]),
+        "environment": "browser"
+    }]
+    
     # Take initial screenshot to start the CUA loop
-    screenshot_bytes = await page.screenshot(full_page=True)
-    screenshot_base64 = base64.b64encode(screenshot_bytes).decode("utf-8")
+    cdp = await get_cdp_session(page)
+    screenshot_base64 = await capture_screenshot(cdp, viewport, data_url=False)
     
     # Initial request to the model with CORRECT format based on documentation
     try:
-        response = client.responses.create(
+        response = await client.responses.create(
             model="computer-use-preview",
-            tools=[{
-                "type": "computer_use_preview",
-                "display_width": int(page.viewport_size["width"]),
-                "display_height": int(page.viewport_size["height"]),
-                "environment": "browser"
-            }],
+            tools=tools,
             input=[
                 {
                     "role": "user",
@@ -77,7 +81,7 @@ async def search_with_cua(page: Page) -> Dict[str, Any]:
                     "type": "image",
                     "source": {
                         "type": "base64", 
-                        "media_type": "image/png", 
+                        "media_type": "image/jpeg", 
                         "data": screenshot_base64
                     }
                 }
@@ -94,6 +98,7 @@ async def search_with_cua(page: Page) -> Dict[str, Any]:
     
     # Start the CUA loop
     completed = False
+    stopped_early = False
     max_iterations = 10
     iteration = 0
     
@@ -101,19 +106,23 @@ async def search_with_cua(page: Page) -> Dict[str, Any]:
         iteration += 1
         print(f"CUA Loop Iteration: {iteration}")
         
-        # Process reasoning if available
+        # Collect computer call actions and print reasoning in a single pass
+        computer_calls = []
         for item in response.output:
-            if item.type == "reasoning":
-                if hasattr(item, "summary") and item.summary:
-                    for summary in item.summary:
-                        if hasattr(summary, "text"):
-                            print(f"Agent reasoning: {summary.text}")
+            if item.type == "computer_call":
+                computer_calls.append(item)
+            elif item.type == "reasoning" and getattr(item, "summary", None):
+                print(f"Agent reasoning: {' | '.join(s.text for s in item.summary if hasattr(s, 'text'))}")
         
-        # Find computer call actions
-        computer_calls = [item for item in response.output if item.type == "computer_call"]
         if not computer_calls:
-            print("No computer actions found. Loop completed.")
-            completed = True
+            # A turn without a computer action ends the loop; the model's message only
+            # tells us whether it considers the task finished
+            if model_reports_done(response):
+                print("No computer actions found and model reports done. Loop completed.")
+                completed = True
+            else:
+                print("No computer actions found and model didn't report done. Stopping early.")
+                stopped_early = True
             break
         
         # Process the computer call (assuming at most one per response)
@@ -157,10 +166,9 @@ async def search_with_cua(page: Page) -> Dict[str, Any]:
         except Exception as e:
             print(f"Error executing action: {e}")
             # Take error screenshot for debugging
-            error_screenshot = await page.screenshot()
-            error_path = f"error_screenshot_{iteration}.png"
-            with open(error_path, "wb") as f:
-                f.write(error_screenshot)
+            error_screenshot = await page.screenshot(type="jpeg", quality=60)
+            error_path = f"error_screenshot_{iteration}.jpg"
+            await asyncio.to_thread(Path(error_path).write_bytes, error_screenshot)
             print(f"Error screenshot saved to {error_path}")
             
             # If we've had errors for multiple iterations, fall back to manual search
@@ -169,8 +177,7 @@ async def search_with_cua(page: Page) -> Dict[str, Any]:
                 return await search_manually(page)
         
         # Take a new screenshot after the action
-        screenshot_bytes = await page.screenshot(full_page=True)
-        screenshot_base64 = base64.b64encode(screenshot_bytes).decode("utf-8")
+        screenshot_base64 = await capture_screenshot(cdp, viewport, data_url=False)
         
         # Build the next input with correct output format
         next_input = [{
@@ -180,7 +187,7 @@ async def search_with_cua(page: Page) -> Dict[str, Any]:
                 "type": "image",
                 "source": {
                     "type": "base64", 
-                    "media_type": "image/png", 
+                    "media_type": "image/jpeg", 
                     "data": screenshot_base64
                 }
             }
@@ -192,15 +199,10 @@ async def search_with_cua(page: Page) -> Dict[str, Any]:
             
         # Continue the CUA loop
         try:
-            response = client.responses.create(
+            response = await client.responses.create(
                 model="computer-use-preview",
                 previous_response_id=response.id,
-                tools=[{
-                    "type": "computer_use_preview",
-                    "display_width": int(page.viewport_size["width"]),
-                    "display_height": int(page.viewport_size["height"]),
-                    "environment": "browser"
-                }],
+                tools=tools,
                 input=next_input,
                 truncation="auto"
             )
@@ -217,9 +219,12 @@ async def search_with_cua(page: Page) -> Dict[str, Any]:
             break
             
     # Return the final state
+    final_url = page.url
+    search_found = "amazon.com" in final_url and "mango" in final_url.lower()
     return {
-        "url": page.url,
-        "status": "complete" if "amazon.com" in page.url and "mango" in page.url.lower() else "incomplete",
+        "url": final_url,
+        "status": "complete" if search_found else
+                  "incomplete_early" if stopped_early else "incomplete",
         "iterations": iteration,
         "method": "cua"
     }
@@ -235,8 +240,7 @@ async def search_manually(page: Page) -> Dict[str, Any]:
         # If we're not on Amazon already, navigate there
         if "amazon.com" not in page.url:
             print("Navigating to Amazon.com...")
-            await page.goto("https://www.amazon.com")
-            await page.wait_for_load_state("networkidle", timeout=10000)
+            await page.goto("https://www.amazon.com", wait_until="domcontentloaded", timeout=15000)
         
         # Find and use the search box - improved approach
         search_success = False
@@ -1,9 +1,87 @@
 import asyncio
-import base64
 import json
+import re
 from typing import Dict, Any, List
 from playwright.async_api import Page, TimeoutError
-from openai import OpenAI
+from shared import get_client, get_cdp_session, model_reports_done, capture_screenshot
+
+# Screenshots sent to the CUA model are downscaled by this factor, and never wider than
+# MAX_SCREENSHOT_WIDTH since the model downscales larger images anyway. The model works in
+# screenshot coordinates, so display size and action coordinates are scaled to match.
+SCREENSHOT_SCALE = 0.5
+MAX_SCREENSHOT_WIDTH = 1280
+
+# Text that shows up on the page once an item is in the cart
+_CART_OK = re.compile(
+    r"added to cart|cart subtotal|proceed to checkout|cart updated|huc-v2-order-row-confirm-text",
+    re.IGNORECASE
+)
+
+# Reads the #nav-cart-count badge; -1 when the badge is missing
+_CART_COUNT_JS = """() => {
+    const e = document.querySelector("#nav-cart-count");
+    return e ? parseInt(e.textContent.trim() || "0", 10) : -1;
+}"""
+
+# In-page cart check that returns only a boolean. The cart badge is checked first: it must
+# have gone up from the count read before adding (baseline, -1 if unknown), since the
+# persistent profile can keep items from earlier runs. After that, the page text is scanned
+# once per document; a MutationObserver then flips window.__cart when a success message
+# appears, so later checks just read the flag.
+_CART_PROBE_JS = """(baseline) => {
+    const e = document.querySelector("#nav-cart-count");
+    if (baseline >= 0 && e && parseInt(e.textContent.trim() || "0", 10) > baseline) return true;
+    if (window.__cart === undefined && document.body) {
+        const check = () =>
+            /added to cart|cart subtotal|proceed to checkout|cart updated/i.test(document.body.innerText) ||
+            !!document.getElementById("huc-v2-order-row-confirm-text");
+        window.__cart = check();
+        new MutationObserver(() => { if (!window.__cart && check()) window.__cart = true; })
+            .observe(document.body, {subtree: true, childList: true, characterData: true});
+    }
+    return !!window.__cart;
+}"""
+
+# Returns the index of the first selector, from start on, that matches an element; -1 if none
+_FIRST_MATCH_JS = """([selectors, start]) => {
+    for (let i = start; i < selectors.length; i++) {
+        if (document.querySelector(selectors[i])) return i;
+    }
+    return -1;
+}"""
+
+# Installs (once per document) a MutationObserver that tracks how long the DOM has been quiet
+_IDLE_PROBE_JS = """() => {
+    if (!window.__idle) {
+        let last = Date.now();
+        new MutationObserver(() => { last = Date.now(); })
+            .observe(document, {subtree: true, childList: true, attributes: true});
+        window.__idle = () => Date.now() - last;
+    }
+}"""
+
+def screenshot_scale(viewport: Dict[str, int]) -> float:
+    """Returns the downscale factor for screenshots of this viewport."""
+    return min(SCREENSHOT_SCALE, MAX_SCREENSHOT_WIDTH / viewport["width"])
+
+def to_page_coord(value: float, scale: float) -> int:
+    """Maps a coordinate from the downscaled screenshot back to page pixels."""
+    return int(value / scale)
+
+async def wait_for_dom_idle(page: Page, quiet_ms: int = 400, timeout: int = 3000) -> None:
+    """
+    Waits until the DOM has gone quiet_ms without mutations, or until timeout.
+    Returns as soon as the page is settled instead of sleeping a fixed amount.
+    """
+    try:
+        await page.evaluate(_IDLE_PROBE_JS)
+        await page.wait_for_function(
+            f"() => window.__idle && window.__idle() > {quiet_ms}",
+            timeout=timeout
+        )
+    except Exception:
+        # Timed out or navigated mid-wait; carry on with the current state
+        pass
 
 async def select_item_agent(page: Page) -> Dict[str, Any]:
     """
@@ -12,15 +90,30 @@ async def select_item_agent(page: Page) -> Dict[str, Any]:
     2. Navigating to the product detail page
     3. Adding the product to the cart
     """
-    client = OpenAI()
+    client = get_client()
     
     # Initialize status tracking
     cart_added = False
     product_selected = False
     
+    # The tools payload doesn't change during the loop, so build it once
+    viewport = page.viewport_size
+    scale = screenshot_scale(viewport)
+    tools = [{
+        "type": "computer_use_preview",
+        "display_width": int(viewport["width"] * scale),
+        "display_height": int(viewport["height"] * scale),
+        "environment": "browser"
+    }]
+    
+    # One CDP session per page is reused for every screenshot
+    cdp = await get_cdp_session(page)
+    
     # Take initial screenshot to start the CUA loop
-    screenshot_bytes = await page.screenshot(full_page=True)
-    screenshot_base64 = base64.b64encode(screenshot_bytes).decode("utf-8")
+    screenshot_url = await capture_screenshot(cdp, viewport, "webp", 75, scale)
+    
+    # Cart badge count before anything is added, so leftover items don't count as success
+    cart_baseline = await cart_count(page)
     
     # First, try manual approach (more reliable)
     print("Starting mango product selection process...")
@@ -34,14 +127,9 @@ async def select_item_agent(page: Page) -> Dict[str, Any]:
         print("Manual selection didn't complete. Trying computer vision approach...")
         
         # Initial request to the CUA model with CORRECT format according to documentation
-        response = client.responses.create(
+        response = await client.responses.create(
             model="computer-use-preview",
-            tools=[{
-                "type": "computer_use_preview",
-                "display_width": int(page.viewport_size["width"]),
-                "display_height": int(page.viewport_size["height"]),
-                "environment": "browser"
-            }],
+            tools=tools,
             input=[
                 {
                     "role": "user",
@@ -49,7 +137,7 @@ async def select_item_agent(page: Page) -> Dict[str, Any]:
                 },
                 {
                     "type": "input_image",
-                    "image_url": f"data:image/png;base64,{screenshot_base64}"
+                    "image_url": screenshot_url
                 }
             ],
             reasoning={"generate_summary": "concise"},
@@ -62,6 +150,7 @@ async def select_item_agent(page: Page) -> Dict[str, Any]:
 
     # Start the CUA loop
     completed = False
+    stopped_early = False
     max_iterations = 15
     iteration = 0
     
@@ -69,18 +158,23 @@ async def select_item_agent(page: Page) -> Dict[str, Any]:
         iteration += 1
         print(f"CUA Loop Iteration: {iteration}")
         
-        # Process any reasoning
+        # Collect computer call actions and print reasoning in a single pass
+        computer_calls = []
         for item in response.output:
-            if item.type == "reasoning" and hasattr(item, "summary"):
-                for summary in item.summary:
-                    if hasattr(summary, "text"):
-                        print(f"CUA reasoning: {summary.text}")
+            if item.type == "computer_call":
+                computer_calls.append(item)
+            elif item.type == "reasoning" and getattr(item, "summary", None):
+                print(f"CUA reasoning: {' | '.join(s.text for s in item.summary if hasattr(s, 'text'))}")
         
-        # Find computer call actions
-        computer_calls = [item for item in response.output if item.type == "computer_call"]
         if not computer_calls:
-            print("No computer actions found. CUA workflow complete.")
-            completed = True
+            # A turn without a computer action ends the loop; the model's message only
+            # tells us whether it considers the task finished
+            if model_reports_done(response):
+                print("No computer actions found and model reports done. CUA workflow complete.")
+                completed = True
+            else:
+                print("No computer actions found and model didn't report done. Stopping early.")
+                stopped_early = True
             break
         
         # Process the computer call
@@ -98,7 +192,7 @@ async def select_item_agent(page: Page) -> Dict[str, Any]:
             print(f"Executing action: {action.type}")
             
             if action.type == "click":
-                await page.mouse.click(action.x, action.y, button=action.button)
+                await page.mouse.click(to_page_coord(action.x, scale), to_page_coord(action.y, scale), button=action.button)
                 
             elif action.type == "type":
                 await page.keyboard.type(action.text)
@@ -108,26 +202,25 @@ async def select_item_agent(page: Page) -> Dict[str, Any]:
                     await page.keyboard.press(key)
                     
             elif action.type == "scroll":
-                await page.mouse.move(action.x, action.y)
-                await page.evaluate(f"window.scrollBy({action.scroll_x}, {action.scroll_y})")
+                await page.mouse.move(to_page_coord(action.x, scale), to_page_coord(action.y, scale))
+                await page.evaluate(f"window.scrollBy({to_page_coord(action.scroll_x, scale)}, {to_page_coord(action.scroll_y, scale)})")
                 
             elif action.type == "wait":
                 await asyncio.sleep(2)
-                
-            # Give the page a moment to update
-            await asyncio.sleep(2)
             
         except Exception as e:
             print(f"Error executing action: {e}")
         
-        # Wait for page to stabilize
+        # Wait for page to stabilize: DOM loaded, then no mutations for a moment
         try:
             await page.wait_for_load_state("domcontentloaded", timeout=5000)
         except Exception:
-            await asyncio.sleep(2)
+            pass
+        await wait_for_dom_idle(page)
+        cur_url = page.url
         
         # Track progress in the workflow
-        if not product_selected and "/dp/" in page.url:
+        if not product_selected and "/dp/" in cur_url:
             print("✅ Successfully navigated to product detail page")
             product_selected = True
             
@@ -137,16 +230,21 @@ async def select_item_agent(page: Page) -> Dict[str, Any]:
                 if add_success:
                     cart_added = True
                     print("✅ Manually added product to cart")
+                    completed = True
+                    break
+        
+        # Probe the cart state and take the next screenshot concurrently
+        in_cart, screenshot_url = await asyncio.gather(
+            is_added_to_cart(page, cart_baseline),
+            capture_screenshot(cdp, viewport, "webp", 75, scale)
+        )
         
         # Check for cart add success
-        current_content = await page.content()
-        if not cart_added and await is_added_to_cart(page, current_content):
+        if not cart_added and in_cart:
             print("✅ Product successfully added to cart!")
             cart_added = True
-        
-        # Take a new screenshot
-        screenshot_bytes = await page.screenshot(full_page=True)
-        screenshot_base64 = base64.b64encode(screenshot_bytes).decode("utf-8")
+            completed = True
+            break
         
         # Build the next input with correct format
         next_input = [{
@@ -154,7 +252,7 @@ async def select_item_agent(page: Page) -> Dict[str, Any]:
             "type": "computer_call_output",
             "output": {
                 "type": "input_image",  # FIXED: Changed from "computer_screenshot" to "input_image"
-                "image_url": f"data:image/png;base64,{screenshot_base64}"
+                "image_url": screenshot_url
             }
         }]
         
@@ -162,20 +260,25 @@ async def select_item_agent(page: Page) -> Dict[str, Any]:
         if pending_safety_checks:
             next_input[0]["acknowledged_safety_checks"] = pending_safety_checks
             
-        # Continue the CUA loop
+        # Continue the CUA loop: send the request in the background so the cart can be
+        # checked locally while the model is thinking
+        response_task = asyncio.create_task(client.responses.create(
+            model="computer-use-preview",
+            previous_response_id=response.id,
+            tools=tools,
+            input=next_input,
+            truncation="auto"
+        ))
+        if not cart_added:
+            await asyncio.sleep(0.5)
+            if await is_added_to_cart(page, cart_baseline):
+                print("✅ Product successfully added to cart! Skipping the pending CUA response.")
+                response_task.cancel()
+                cart_added = True
+                completed = True
+                break
         try:
-            response = client.responses.create(
-                model="computer-use-preview",
-                previous_response_id=response.id,
-                tools=[{
-                    "type": "computer_use_preview",
-                    "display_width": int(page.viewport_size["width"]),
-                    "display_height": int(page.viewport_size["height"]),
-                    "environment": "browser"
-                }],
-                input=next_input,
-                truncation="auto"
-            )
+            response = await response_task
         except Exception as e:
             print(f"Error in CUA loop: {e}")
             # If CUA fails, fall back to manual process
@@ -204,12 +307,19 @@ async def select_item_agent(page: Page) -> Dict[str, Any]:
     # Verify cart contents as a final step
     if cart_added:
         try:
-            print("Navigating to cart to verify...")
-            await page.goto("https://www.amazon.com/gp/cart/view.html")
-            await asyncio.sleep(2)
-            
-            cart_content = await page.content()
-            if "mango" in cart_content.lower() and not "empty" in cart_content.lower():
+            print("Fetching cart to verify...")
+            # Fetch the cart page from inside the current page instead of navigating away,
+            # so only a boolean comes back over CDP. The cart badge in the fetched page must
+            # be above the baseline too, since the cart can hold mangos from earlier runs.
+            in_cart = await page.evaluate("""async (baseline) => {
+                const r = await fetch("/gp/cart/view.html", {credentials: "include"});
+                const t = await r.text();
+                const badge = new DOMParser().parseFromString(t, "text/html").querySelector("#nav-cart-count");
+                const count = badge ? parseInt(badge.textContent.trim() || "0", 10) : -1;
+                const grew = baseline < 0 || count < 0 || count > baseline;
+                return grew && /mango/i.test(t) && !/cart is empty/i.test(t);
+            }""", cart_baseline)
+            if in_cart:
                 print("✅ Confirmed mango product in cart!")
                 cart_added = True
             else:
@@ -222,7 +332,8 @@ async def select_item_agent(page: Page) -> Dict[str, Any]:
     return {
         "url": page.url,
         "status": "complete" if (product_selected and cart_added) else 
-                 "partial" if product_selected else "incomplete",
+                 "partial" if product_selected else
+                 "incomplete_early" if stopped_early else "incomplete",
         "product_page": product_selected,
         "cart_added": cart_added,
         "iterations": iteration
@@ -240,44 +351,41 @@ async def manual_select_and_add_to_cart(page: Page) -> Dict[str, Any]:
         # Step 1: Try to find and click on a mango product
         if "/dp/" not in page.url:
             print("Looking for a mango product to click...")
-            product_links = []
             
             # Try different ways to find product links
             try:
-                # Method 1: Look for links containing product images
-                links = await page.query_selector_all("a.a-link-normal.s-no-outline")
-                if links:
-                    product_links.extend(links)
-                
-                # Method 2: Look for div elements that contain product info
-                product_divs = await page.query_selector_all("div[data-asin]:not([data-asin=''])") 
-                for div in product_divs:
-                    link = await div.query_selector("a")
-                    if link:
-                        product_links.append(link)
+                # Run every link strategy in a single call to the browser:
+                # Method 1: links containing product images
+                # Method 2: the first link inside each div that contains product info
+                # Method 3 (desperate): any link with "mango" in the text
+                # Product links mentioning mango are preferred over the first product link
+                product_link = await page.evaluate("""() => {
+                    const links = [...document.querySelectorAll("a.a-link-normal.s-no-outline")];
+                    for (const div of document.querySelectorAll("div[data-asin]:not([data-asin=''])")) {
+                        const a = div.querySelector("a");
+                        if (a) links.push(a);
+                    }
+                    const candidates = links.filter(a => a.href);
+                    const mango = candidates.find(a => /mango/i.test(a.textContent));
+                    if (mango || candidates.length) return (mango || candidates[0]).href;
+                    const textLink = [...document.querySelectorAll("a[href]")]
+                        .find(a => /mango/i.test(a.textContent));
+                    return textLink ? textLink.href : null;
+                }""")
                 
-                # If we found products, click the first one
-                if product_links:
-                    print(f"Found {len(product_links)} potential products. Clicking first one...")
-                    await product_links[0].click()
-                    await asyncio.sleep(3)
+                # If we found a product, open it
+                if product_link:
+                    print(f"Found a potential product. Opening {product_link}...")
+                    await page.goto(product_link, wait_until="domcontentloaded")
                     
                     # Check if we navigated to a product page
                     if "/dp/" in page.url:
                         product_selected = True
                         print("✅ Successfully navigated to product page")
                     else:
-                        print("⚠️ Clicked but didn't navigate to a product page")
+                        print("⚠️ Opened link but didn't navigate to a product page")
                 else:
-                    # Desperate approach: look for any link with "mango" in the text
-                    mango_links = await page.query_selector_all("a:has-text('mango')")
-                    if mango_links:
-                        print("Found links with 'mango' text. Clicking first one...")
-                        await mango_links[0].click()
-                        await asyncio.sleep(3)
-                        if "/dp/" in page.url:
-                            product_selected = True
-                            print("✅ Successfully navigated to product page (via text search)")
+                    print("⚠️ No product links found on the page")
             except Exception as e:
                 print(f"Error selecting product: {e}")
         else:
@@ -318,6 +426,7 @@ async def click_add_to_cart_button(page: Page) -> bool:
     Returns True if successful.
     """
     print("Attempting to click Add to Cart button...")
+    cart_baseline = await cart_count(page)
     
     # Strategy 1: Try the exact selector we know works on Amazon
     selectors = [
@@ -331,22 +440,27 @@ async def click_add_to_cart_button(page: Page) -> bool:
         "span#submit\\.add-to-cart"
     ]
     
-    for selector in selectors:
-        try:
-            print(f"Trying selector: {selector}")
-            button = await page.query_selector(selector)
-            if button:
-                await button.scroll_into_view_if_needed()
-                await asyncio.sleep(1)
-                await button.click()
-                await asyncio.sleep(3)
+    # One evaluate finds the first selector (in priority order) that matches; if clicking it
+    # doesn't add the item, the search resumes after that selector
+    try:
+        print("Trying known Add to Cart selectors...")
+        start = 0
+        while start < len(selectors):
+            index = await page.evaluate(_FIRST_MATCH_JS, [selectors, start])
+            if index < 0:
+                break
+            try:
+                await page.locator(selectors[index]).first.click(timeout=5000)
+                await wait_for_dom_idle(page)
                 
                 # Check if successfully added to cart
-                content = await page.content()
-                if await is_added_to_cart(page, content):
+                if await is_added_to_cart(page, cart_baseline):
                     return True
-        except Exception as e:
-            print(f"Error with selector {selector}: {e}")
+            except Exception as e:
+                print(f"Error clicking {selectors[index]}: {e}")
+            start = index + 1
+    except Exception as e:
+        print(f"Error with Add to Cart selectors: {e}")
     
     # Strategy 2: Try finding by text "Add to Cart"
     try:
@@ -355,12 +469,10 @@ async def click_add_to_cart_button(page: Page) -> bool:
             for element in add_text_elements:
                 try:
                     await element.scroll_into_view_if_needed()
-                    await asyncio.sleep(1)
                     await element.click()
-                    await asyncio.sleep(3)
+                    await wait_for_dom_idle(page)
                     
-                    content = await page.content()
-                    if await is_added_to_cart(page, content):
+                    if await is_added_to_cart(page, cart_baseline):
                         return True
                 except Exception:
                     continue
@@ -412,47 +524,41 @@ async def click_add_to_cart_button(page: Page) -> bool:
         """
         
         result = await page.evaluate(script)
-        await asyncio.sleep(3)
+        await wait_for_dom_idle(page)
         
-        content = await page.content()
-        if result or await is_added_to_cart(page, content):
+        if result or await is_added_to_cart(page, cart_baseline):
             return True
     except Exception as e:
         print(f"JavaScript approach failed: {e}")
     
     return False
 
-async def is_added_to_cart(page: Page, content: str = None) -> bool:
+async def is_added_to_cart(page: Page, baseline: int, content: str = None) -> bool:
     """
-    Checks if an item was successfully added to the cart.
+    Checks if an item was successfully added to the cart. baseline is the cart badge count
+    read before adding (see cart_count); the badge only counts if it went up from there.
+    Without content, the check runs inside the page so the HTML is never serialized.
     """
     if content is None:
-        content = await page.content()
+        try:
+            return bool(await page.evaluate(_CART_PROBE_JS, baseline))
+        except Exception as e:
+            print(f"Cart probe failed, falling back to page content: {e}")
+            content = await page.content()
     
-    # Check for success indicators in the page content
-    success_indicators = [
-        "Added to Cart",
-        "added to cart",
-        "added to Cart",
-        "Cart subtotal",
-        "Proceed to checkout",
-        "proceed to checkout",
-        "Cart updated",
-        "huc-v2-order-row-confirm-text"
-    ]
-    
-    for indicator in success_indicators:
-        if indicator.lower() in content.lower():
-            return True
+    # Check for success indicators in the page content (one case-insensitive scan)
+    if _CART_OK.search(content):
+        return True
     
     # Check for cart count increase
+    return baseline >= 0 and await cart_count(page) > baseline
+
+async def cart_count(page: Page) -> int:
+    """
+    Returns the number shown on the cart badge, or -1 if it can't be read.
+    """
     try:
-        cart_count_element = await page.query_selector("#nav-cart-count")
-        if cart_count_element:
-            count_text = await cart_count_element.text_content()
-            if count_text and int(count_text.strip()) > 0:
-                return True
+        count = await page.evaluate(_CART_COUNT_JS)
+        return count if isinstance(count, int) else -1
     except Exception:
-        pass
-    
-    return False
\ No newline at end of file
+        return -1
\ No newline at end of file
@@ -0,0 +1,68 @@
+import hashlib
+import weakref
+from typing import Any, Dict, Optional
+import httpx
+from playwright.async_api import Page
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+# One client for the supervisor and every agent, so the HTTP connection pool
+# (and its TLS sessions) is reused across calls
+_CLIENT: Optional[AsyncOpenAI] = None
+
+def get_client() -> AsyncOpenAI:
+    """Returns the process-wide async OpenAI client, creating it on first use."""
+    global _CLIENT
+    if _CLIENT is None:
+        _CLIENT = AsyncOpenAI(
+            timeout=30.0,
+            max_retries=2,
+            http_client=DefaultAsyncHttpxClient(limits=httpx.Limits(max_keepalive_connections=20))
+        )
+    return _CLIENT
+
+# CDP sessions keyed by page, so the supervisor and the agents share one session per page
+_CDP_SESSIONS: "weakref.WeakKeyDictionary[Page, Any]" = weakref.WeakKeyDictionary()
+
+async def get_cdp_session(page: Page):
+    """Returns the CDP session for this page, creating it on first use."""
+    cdp = _CDP_SESSIONS.get(page)
+    if cdp is None:
+        cdp = await page.context.new_cdp_session(page)
+        _CDP_SESSIONS[page] = cdp
+    return cdp
+
+def model_reports_done(response) -> bool:
+    """Returns True if a text message in the model output says the task is done."""
+    for item in response.output:
+        if item.type == "message":
+            for content in getattr(item, "content", None) or []:
+                if "done" in (getattr(content, "text", None) or "").lower():
+                    return True
+    return False
+
+async def capture_screenshot(
+    cdp,
+    viewport: Dict[str, int],
+    fmt: str = "jpeg",
+    quality: int = 70,
+    scale: float = 1.0,
+    data_url: bool = True
+) -> str:
+    """
+    Captures the viewport through a CDP session, downscaled by scale, and returns it as a
+    data URL (or bare base64 when data_url is False). The browser does the encoding and
+    resize, and CDP already returns base64, so nothing is re-encoded in Python.
+    """
+    result = await cdp.send("Page.captureScreenshot", {
+        "format": fmt,
+        "quality": quality,
+        "captureBeyondViewport": False,
+        "clip": {"x": 0, "y": 0, "width": viewport["width"], "height": viewport["height"], "scale": scale}
+    })
+    if not data_url:
+        return result["data"]
+    return f"data:image/{fmt};base64," + result["data"]
+
+def frame_hash(screenshot: str) -> bytes:
+    """Returns a short digest used to tell whether two screenshots are identical."""
+    return hashlib.blake2b(screenshot.encode("ascii"), digest_size=16).digest()
@@ -1,16 +1,147 @@
 import os
+import sys
+import signal
 import asyncio
-import base64
 import json
+import re
 import time
-from typing import Dict, Any
-from openai import OpenAI
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Dict, Any, Optional
+from urllib.parse import urlparse
 from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
 from dotenv import load_dotenv
 from imhuman import solve_captcha
+from shared import get_client, get_cdp_session, capture_screenshot, frame_hash
 from mango_finder_agent import mango_finder_agent
 from select_item_agent import select_item_agent
 
+# CAPTCHA markers, matched against the page URL and title (and page HTML as a fallback).
+# Titles also count "verify", which is too common to look for anywhere else.
+CAPTCHA_RE = re.compile(r"captcha|robot check|solve this puzzle", re.IGNORECASE)
+CAPTCHA_TITLE_RE = re.compile(r"captcha|robot check|solve this puzzle|verify", re.IGNORECASE)
+
+# Cart-page markers, used on the raw HTML only when the in-page cart check fails
+MANGO_RE = re.compile(r"mango", re.IGNORECASE)
+EMPTY_CART_RE = re.compile(r"empty|was removed", re.IGNORECASE)
+
+# Computes page-state flags (and reads the title) inside the browser so only a few bytes
+# come back over CDP instead of the whole serialized page. The robot-check page is
+# recognized by its form and image selectors or by its title, so the body text isn't read.
+# cartCount is the #nav-cart-count badge, or -1 if the page has none.
+PAGE_FLAGS_JS = """() => ({
+    title: document.title,
+    captcha: !!document.querySelector("form[action*='validateCaptcha'], #captchacharacters, img[src*='captcha']") ||
+        /captcha|robot check|solve this puzzle/i.test(document.title),
+    navLogo: !!document.querySelector("#nav-logo, a[href*='nav_logo']"),
+    cartCount: (e => e ? parseInt(e.textContent.trim() || "0", 10) : -1)(document.querySelector("#nav-cart-count"))
+})"""
+
+# Reads the cart state inside the browser, scoped to the active cart rather than the whole page.
+# cartCount is the #nav-cart-count badge (-1 if missing), compared against the count read
+# when the run started since the persistent profile keeps the cart between runs.
+CART_STATE_JS = """() => {
+    const cart = document.querySelector("#sc-active-cart") || document.body;
+    const text = cart ? cart.innerText : "";
+    const badge = document.querySelector("#nav-cart-count");
+    return {
+        cartCount: badge ? parseInt(badge.textContent.trim() || "0", 10) : -1,
+        hasMango: /mango/i.test(text),
+        cartEmpty: !!document.querySelector("#sc-active-cart .sc-empty-cart, .sc-your-amazon-cart-is-empty") ||
+            /your amazon cart is empty|was removed/i.test(text)
+    };
+}"""
+
+# Elements that show an Amazon page (or its CAPTCHA) has rendered enough to act on.
+# Call sites that know where they should land wait for something more specific.
+PAGE_LANDMARK_SELECTOR = "#nav-logo, input[name='field-keywords'], form[action*='validateCaptcha']"
+HOMEPAGE_READY_SELECTOR = "#twotabsearchtextbox, form[action*='validateCaptcha']"
+SEARCH_RESULTS_READY_SELECTOR = "[data-component-type='s-search-result'], form[action*='validateCaptcha']"
+
+# Action codes the supervisor can choose
+ACTION_RE = re.compile(r"USE_IMHUMAN|USE_MANGO_FINDER|USE_ITEM_SELECTOR|FINISHED")
+
+# Matches a reported CAPTCHA in a (possibly truncated) streamed JSON answer
+CAPTCHA_PRESENT_RE = re.compile(r'"captcha_present"\s*:\s*true')
+
+# System messages are module constants so every call sends an identical prefix, which lets
+# OpenAI's prompt caching kick in. Per-call state goes in the user message instead.
+SUPERVISOR_SYSTEM_MSG = {
+    "role": "system",
+    "content": (
+        "You are a supervisor agent that analyzes Amazon screenshots and decides the best next action. "
+        "Your goal is to help order mango slices from Amazon. "
+        "The user message describes the current workflow state.\n\n"
+        "Based on what you see, choose ONE of these actions:\n"
+        "1. USE_IMHUMAN: If you see a CAPTCHA or robot check\n"
+        "2. USE_MANGO_FINDER: If you're on the Amazon homepage or need to search for mango slices\n"
+        "3. USE_ITEM_SELECTOR: If you see search results and need to select a product\n"
+        "4. FINISHED: If the goal has been achieved (product selected or added to cart)\n"
+        "Respond with a JSON object: "
+        '{"captcha_present": <true|false>, "action": "<ONE action code>", "reason": "<a few words>"}'
+    )
+}
+
+CART_VERIFY_SYSTEM_MSG = {
+    "role": "system",
+    "content": "Verify if there are any mango products in this Amazon shopping cart. Answer only YES or NO, followed by a brief explanation."
+}
+
+# The decision screenshot is downscaled by this factor (1024x768 -> 768x576) before it is
+# sent to the vision model; fewer pixels means fewer image tiles to pay for
+DECISION_SCREENSHOT_SCALE = 0.75
+
+# Browser profile directory reused across runs (cookies, cache)
+BROWSER_PROFILE_DIR = ".pw_profile"
+
+# URL patterns blocked in the browser itself via CDP (Network.setBlockedURLs), so the
+# HTTP cache keeps working and requests never round-trip through Python. Ad and analytics
+# hosts never affect a decision; fonts, video and text tracks (matched by extension, as
+# CDP can't block by resource type) don't change what the agents see. Images and
+# stylesheets stay enabled because every decision is made from a rendered screenshot,
+# and CAPTCHAs are images.
+BLOCKED_URL_PATTERNS = [
+    "*amazon-adsystem.com*",
+    "*doubleclick.net*",
+    "*googletagmanager.com*",
+    "*googletagservices.com*",
+    "*googlesyndication.com*",
+    "*google-analytics.com*",
+    "*fls-na.amazon.com*",
+    "*unagi.amazon.com*",
+    "*.woff",
+    "*.woff2",
+    "*.ttf",
+    "*.otf",
+    "*.mp4",
+    "*.webm",
+    "*.m3u8",
+    "*.vtt",
+]
+
+class PageState:
+    """
+    Tracks what kind of Amazon page is loaded, based on the responses to main-frame
+    navigations. Amazon serves its robot-check page with HTTP 503, which the DOM
+    and URL checks can't see.
+    """
+    def __init__(self):
+        self.on_search = False
+        self.on_product = False
+        self.captcha_shown = False
+
+    def update_from(self, response) -> None:
+        request = response.request
+        try:
+            if not request.is_navigation_request() or request.frame.parent_frame is not None:
+                return
+        except Exception:
+            return
+        url = response.url.lower()
+        self.on_search = "amazon.com" in url and "/s?" in url
+        self.on_product = "/dp/" in url
+        self.captcha_shown = response.status == 503 or "captcha" in url
+
 async def simple_supervisor():
     """
     An enhanced supervisor agent that:
@@ -23,20 +154,50 @@ async def simple_supervisor():
     """
     # Load environment variables and initialize OpenAI client
     load_dotenv()
-    client = OpenAI()
     
-    # Set up browser with Playwright
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=False)
-        page = await browser.new_page(viewport={"width": 1024, "height": 768})
+    # The first Ctrl+C asks the workflow to stop after the current interaction instead of
+    # prompting for confirmation every iteration. It also puts back the previous handler,
+    # so a second Ctrl+C raises KeyboardInterrupt and aborts whatever is running.
+    stop_requested = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    previous_sigint = signal.getsignal(signal.SIGINT) or signal.default_int_handler
+    
+    def restore_sigint():
+        try:
+            if loop.remove_signal_handler(signal.SIGINT):
+                signal.signal(signal.SIGINT, previous_sigint)
+        except NotImplementedError:
+            pass
+    
+    def on_sigint():
+        stop_requested.set()
+        restore_sigint()
+        print("\nStopping after the current interaction. Press Ctrl+C again to abort.")
+    
+    try:
+        loop.add_signal_handler(signal.SIGINT, on_sigint)
+        print("Press Ctrl+C to stop after the current interaction.")
+    except NotImplementedError:
+        pass  # Not supported on Windows; Ctrl+C raises KeyboardInterrupt there
+    client = get_client()
+    
+    # The browser is shared across runs (see get_browser_context); each run gets its own tab
+    async with open_page() as page:
+        cdp = await get_cdp_session(page)
+        await cdp.send("Network.enable")
+        await cdp.send("Network.setBlockedURLs", {"urls": BLOCKED_URL_PATTERNS})
+        page_state = PageState()
+        page.on("response", page_state.update_from)
         
         try:
             # Step 1: Navigate to Amazon.com
             print("Navigating to Amazon.com...")
-            await page.goto("https://www.amazon.com")
+            await page.goto("https://www.amazon.com", wait_until="domcontentloaded", timeout=15000)
             
-            # Use a more robust wait approach
-            await wait_for_page_with_fallback(page, "networkidle", timeout=10000)
+            # Give the search box a moment to render before the first screenshot
+            await wait_for_page_with_fallback(
+                page, "domcontentloaded", timeout=10000, selector=HOMEPAGE_READY_SELECTOR
+            )
             
             # Loop to handle multiple interactions
             max_interactions = 10
@@ -45,41 +206,72 @@ async def simple_supervisor():
             select_item_invoked = False
             captcha_just_solved = False  # Track if we just solved a CAPTCHA
             captcha_attempts = 0  # Track consecutive CAPTCHA attempts
+            last_decision_key = None  # Frame digest, URL and state behind the last vision decision
+            last_decision = None
+            # (url, title, screenshot) from an interaction that left the page alone, so the
+            # next one can skip the screenshot if nothing changed
+            idle_frame = None
+            # Cart badge count before any agent could add to the cart (-1 until read)
+            cart_baseline = -1
+            steady_state_iters = 0  # Consecutive interactions where nothing acted and nothing changed
             
             while interaction_count < max_interactions:
-                interaction_count += 1
+                # Stop if the user pressed Ctrl+C. Checked first so no branch's `continue`
+                # can start another agent after a stop was requested
+                if stop_requested.is_set():
+                    print("\nStop requested. Ending workflow...")
+                    break
                 
-                # Take a screenshot of the current page
-                print(f"Taking screenshot (interaction {interaction_count})...")
-                screenshot_bytes = await page.screenshot(full_page=True)
-                screenshot_base64 = base64.b64encode(screenshot_bytes).decode("utf-8")
+                interaction_count += 1
                 
-                # Get page title and URL to help with state detection
-                page_title = await page.title()
+                # Take a screenshot and get the page title and flags to help with state
+                # detection. The flags probe returns the title too, and both round-trips
+                # are independent, so run them together.
                 page_url = page.url
-                page_content = await page.content()
+                if idle_frame is not None and idle_frame[0] == page_url:
+                    # Nothing acted on the page last time; reuse the frame if the title agrees
+                    page_flags = await get_page_flags(page)
+                    page_title = page_flags["title"]
+                    if page_title == idle_frame[1]:
+                        steady_state_iters += 1
+                        if steady_state_iters >= 2:
+                            print("\nPage hasn't changed for 2 interactions and no agent is acting. Stopping early.")
+                            break
+                        print(f"Page unchanged, reusing screenshot (interaction {interaction_count})...")
+                        screenshot_url = idle_frame[2]
+                    else:
+                        steady_state_iters = 0
+                        print(f"Taking screenshot (interaction {interaction_count})...")
+                        screenshot_url = await capture_screenshot(cdp, page.viewport_size, quality=55, scale=DECISION_SCREENSHOT_SCALE)
+                else:
+                    steady_state_iters = 0
+                    print(f"Taking screenshot (interaction {interaction_count})...")
+                    screenshot_url, page_flags = await asyncio.gather(
+                        capture_screenshot(cdp, page.viewport_size, quality=55, scale=DECISION_SCREENSHOT_SCALE),
+                        get_page_flags(page)
+                    )
+                    page_title = page_flags["title"]
+                idle_frame = None
                 
                 # Improved CAPTCHA detection with multiple methods
-                captcha_detected = (
-                    "captcha" in page_url.lower() or 
-                    "robot check" in page_title.lower() or 
-                    "verify" in page_title.lower() or
-                    "captcha" in page_content.lower() or
-                    "robot check" in page_content.lower() or
-                    "solve this puzzle" in page_content.lower()
-                )
+                captcha_detected = detect_captcha(page_url, page_title, page_flags) or page_state.captcha_shown
+                
+                # The cart survives between runs (persistent profile), so success means the
+                # count went up from what it was before the item selector first ran
+                if cart_baseline < 0 and not captcha_detected and not select_item_invoked:
+                    cart_baseline = page_flags["cartCount"]
                 
                 # Check if we're on the Amazon search results page after finding mangos
                 on_search_results = (
-                    "amazon.com" in page_url and 
-                    ("s?k=mango" in page_url or "mango" in page_url.lower()) and
+                    page_state.on_search and 
+                    "mango" in page_url.lower() and
                     not captcha_detected and
                     mango_finder_invoked and
                     not select_item_invoked
                 )
                 
                 # Check if we're on a product detail page
-                on_product_page = "/dp/" in page_url and not captcha_detected
+                on_product_page = page_state.on_product and not captcha_detected
                 
                 # Check if we're already on the cart page
                 on_cart_page = "cart" in page_url.lower() and "amazon.com" in page_url
@@ -100,7 +292,7 @@ async def simple_supervisor():
                         print(f"Added to cart: {selection_result['cart_added']}")
                     
                     # Wait for page to stabilize after selection
-                    await wait_for_page_with_fallback(page, "networkidle", timeout=10000)
+                    await wait_for_page_with_fallback(page, "domcontentloaded", timeout=10000)
                     continue  # Take a new screenshot and reassess
                 
                 # Check if we're on the Amazon homepage after solving a CAPTCHA
@@ -109,7 +301,7 @@ async def simple_supervisor():
                     not captcha_detected and
                     (page_url == "https://www.amazon.com/" or 
                      page_url == "https://www.amazon.com" or
-                     "nav_logo" in page_content)
+                     page_flags["navLogo"])
                 )
                 
                 # If we just solved a CAPTCHA and now we're on the Amazon homepage, go directly to mango search
@@ -128,8 +320,10 @@ async def simple_supervisor():
                     print(f"Mango finder agent completed with status: {mango_result['status']}")
                     print(f"Current URL: {mango_result['url']}")
                     
-                    # Wait for page to stabilize after mango finder actions - use robust wait
-                    await wait_for_page_with_fallback(page, "networkidle", timeout=10000)
+                    # Wait for the search results after mango finder actions - use robust wait
+                    await wait_for_page_with_fallback(
+                        page, "domcontentloaded", timeout=10000, selector=SEARCH_RESULTS_READY_SELECTOR
+                    )
                     continue  # Take a new screenshot and reassess
                 
                 if captcha_detected:
@@ -137,64 +331,43 @@ async def simple_supervisor():
                     print("Invoking imhuman agent to solve CAPTCHA...")
                     captcha_attempts += 1
                     
-                    # Store pre-CAPTCHA state for comparison
-                    pre_captcha_url = page.url
-                    pre_captcha_title = await page.title()
-                    
                     # Call the imhuman agent to solve the CAPTCHA
                     captcha_result = await solve_captcha(page)
+                    print(f"CAPTCHA solution attempt: {captcha_result.get('message', 'No message')}")
+                    captcha_just_solved = captcha_result.get('success', False)
                     
-                    # Enhanced handling of CAPTCHA result
-                    if isinstance(captcha_result, dict):
-                        print(f"CAPTCHA solution attempt: {captcha_result.get('message', 'No message')}")
-                        captcha_just_solved = captcha_result.get('success', False)
+                    if captcha_just_solved:
+                        # solve_captcha waits for the submission's navigation and checks the
+                        # page it lands on, so there's nothing left to re-detect here
+                        print("✅ CAPTCHA solver reports success - skipping the re-check")
                     else:
-                        # For backwards compatibility
-                        print(f"CAPTCHA solution attempt: {captcha_result}")
+                        # Try a more patient approach to waiting for load
+                        print("Waiting for page to stabilize after CAPTCHA submission...")
+                        try:
+                            await wait_for_page_with_fallback(page, "domcontentloaded", timeout=10000)
+                            print("Page stabilized after CAPTCHA submission")
+                        except Exception as e:
+                            print(f"Warning: Timeout waiting for page stabilization: {e}")
+                            # Continue anyway - don't let a timeout stop us
                         
-                        # Wait for a shorter time to let any navigation start
-                        await asyncio.sleep(2)
+                        # Check current state again. The URL, title and the status of the last
+                        # navigation are enough here; the next interaction re-checks the page fully.
+                        current_url = page.url
+                        current_title = await page.title()
                         
-                        # Check if page changed after CAPTCHA solution
-                        post_captcha_url = page.url
-                        post_captcha_title = await page.title()
-                        captcha_just_solved = (
-                            post_captcha_url != pre_captcha_url or 
-                            post_captcha_title != pre_captcha_title
-                        )
-                    
-                    # Try a more patient approach to waiting for load
-                    print("Waiting for page to stabilize after CAPTCHA submission...")
-                    try:
-                        await wait_for_page_with_fallback(page, "networkidle", timeout=10000)
-                        print("Page stabilized after CAPTCHA submission")
-                    except Exception as e:
-                        print(f"Warning: Timeout waiting for page stabilization: {e}")
-                        # Continue anyway - don't let a timeout stop us
-                    
-                    # Check current state again
-                    current_url = page.url
-                    current_title = await page.title()
-                    current_content = await page.content()
-                    
-                    still_captcha = (
-                        "captcha" in current_url.lower() or
-                        "robot check" in current_title.lower() or
-                        "captcha" in current_content.lower() or
-                        "robot check" in current_content.lower()
-                    )
-                    
-                    if still_captcha:
-                        print("⚠️ Still on CAPTCHA page after solution attempt")
-                        captcha_just_solved = False
-                    else:
-                        print("✅ No longer on CAPTCHA page - solution appears successful")
-                        captcha_just_solved = True
+                        still_captcha = detect_captcha(current_url, current_title) or page_state.captcha_shown
+                        
+                        if still_captcha:
+                            print("⚠️ Still on CAPTCHA page after solution attempt")
+                            captcha_just_solved = False
+                        else:
+                            print("✅ No longer on CAPTCHA page - solution appears successful")
+                            captcha_just_solved = True
+                        
+                            # If we're on Amazon homepage, immediately trigger mango finder in next iteration
+                            if "amazon.com" in current_url and not "s?k=" in current_url:
+                                print("Detected Amazon homepage - will search for mangos in next iteration")
                         
-                        # If we're on Amazon homepage, immediately trigger mango finder in next iteration
-                        if "amazon.com" in current_url and not "s?k=" in current_url:
-                            print("Detected Amazon homepage - will search for mangos in next iteration")
-                    
                     continue  # Take a new screenshot and reassess
                 
                 # Determine if this is the Amazon homepage (for clearer decision-making)
@@ -204,53 +377,77 @@ async def simple_supervisor():
                     not "/dp/" in page_url
                 )
                 
-                # Send to OpenAI for analysis using GPT-4 Vision to decide next action
-                print("Analyzing screenshot with OpenAI to decide next action...")
-                response = client.chat.completions.create(
-                    model="gpt-4o",
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": (
-                                "You are a supervisor agent that analyzes Amazon screenshots and decides the best next action. "
-                                "Your goal is to help order mango slices from Amazon. "
-                                f"Current state: {'Amazon homepage' if is_amazon_homepage else 'Amazon page'}, "
-                                f"CAPTCHA just solved: {captcha_just_solved}, "
-                                f"Search already performed: {mango_finder_invoked}, "
-                                f"Product selection already performed: {select_item_invoked}\n\n"
-                                "Based on what you see, choose ONE of these actions:\n"
-                                "1. USE_IMHUMAN: If you see a CAPTCHA or robot check\n"
-                                "2. USE_MANGO_FINDER: If you're on the Amazon homepage or need to search for mango slices\n"
-                                "3. USE_ITEM_SELECTOR: If you see search results and need to select a product\n"
-                                "4. FINISHED: If the goal has been achieved (product selected or added to cart)\n"
-                                "Respond with ONLY ONE of these action codes and a brief explanation."
-                            )
-                        },
-                        {
-                            "role": "user",
-                            "content": [
-                                {"type": "text", "text": "Analyze this Amazon page and decide the next action to take for ordering mango slices:"},
-                                {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{screenshot_base64}"}}
-                            ]
-                        }
-                    ],
-                    max_tokens=150
+                # Skip the vision call when the page state alone determines the next action
+                cart_state = await get_cart_state(page) if on_cart_page else None
+                decision = decide_action(
+                    page_url, captcha_detected, cart_state, cart_baseline, mango_finder_invoked, select_item_invoked
                 )
-                
-                # Extract the recommendation
-                decision = response.choices[0].message.content
+                decision_key = (
+                    frame_hash(screenshot_url),
+                    page_url,
+                    is_amazon_homepage,
+                    captcha_just_solved,
+                    mango_finder_invoked,
+                    select_item_invoked
+                )
+                if decision is not None:
+                    print("Page state already determines the next action, skipping vision analysis.")
+                elif decision_key == last_decision_key:
+                    # Same frame, URL and state as last time, so the model would answer the same
+                    print("Page unchanged since the last analysis, reusing the previous decision.")
+                    decision = last_decision
+                else:
+                    # Send to OpenAI for analysis using GPT-4 Vision to decide next action
+                    print("Analyzing screenshot with OpenAI to decide next action...")
+                    stream = await client.chat.completions.create(
+                        model="gpt-4o-mini",
+                        messages=[
+                            SUPERVISOR_SYSTEM_MSG,
+                            {
+                                "role": "user",
+                                "content": [
+                                    {
+                                        "type": "text",
+                                        "text": (
+                                            f"Current state: {'Amazon homepage' if is_amazon_homepage else 'Amazon page'}, "
+                                            f"CAPTCHA just solved: {captcha_just_solved}, "
+                                            f"Search already performed: {mango_finder_invoked}, "
+                                            f"Product selection already performed: {select_item_invoked}\n\n"
+                                            "Analyze this Amazon page and decide the next action to take for ordering mango slices:"
+                                        )
+                                    },
+                                    {"type": "image_url", "image_url": {"url": screenshot_url, "detail": "low"}}
+                                ]
+                            }
+                        ],
+                        response_format={"type": "json_object"},
+                        max_tokens=30,
+                        stream=True
+                    )
+                    
+                    # Extract the recommendation; the stream is cut as soon as an action code arrives
+                    analysis = await read_until_action(stream)
+                    print(f"Supervisor analysis: {analysis}")
+                    decision = parse_decision(analysis)
+                    last_decision_key = decision_key
+                    last_decision = decision
                 print("\n----- SUPERVISOR DECISION -----")
                 print(decision)
                 print("-------------------------------------\n")
                 
-                # Process the decision
-                if "USE_IMHUMAN" in decision:
+                # Process the decision (one regex scan finds the action code)
+                action = extract_action(decision)
+                
+                # Only the agent actions and the cart check below touch the page
+                if action is None or action == "FINISHED":
+                    idle_frame = (page_url, page_title, screenshot_url)
+                if action == "USE_IMHUMAN":
                     print("Supervisor detected possible CAPTCHA. Invoking imhuman agent...")
                     await solve_captcha(page)
-                    await wait_for_page_with_fallback(page, "networkidle", timeout=10000)
+                    await wait_for_page_with_fallback(page, "domcontentloaded", timeout=10000)
                     captcha_just_solved = True
                     
-                elif "USE_MANGO_FINDER" in decision:
+                elif action == "USE_MANGO_FINDER":
                     print("\n----- INVOKING MANGO FINDER AGENT -----")
                     print("Delegating search task to specialized mango finder agent...")
                     
@@ -268,16 +465,17 @@ async def simple_supervisor():
                         print("Mango finder had trouble completing the task.")
                         
                         # Check if we might have hit a CAPTCHA
-                        post_search_content = await page.content()
-                        if ("captcha" in post_search_content.lower() or 
-                            "robot" in post_search_content.lower()):
+                        post_search_flags = await get_page_flags(page)
+                        if post_search_flags["captcha"]:
                             print("Possible CAPTCHA detected after mango search.")
                             captcha_just_solved = False
                     
-                    # Wait for page to stabilize after mango finder actions
-                    await wait_for_page_with_fallback(page, "networkidle", timeout=10000)
+                    # Wait for the search results after mango finder actions
+                    await wait_for_page_with_fallback(
+                        page, "domcontentloaded", timeout=10000, selector=SEARCH_RESULTS_READY_SELECTOR
+                    )
                     
-                elif "USE_ITEM_SELECTOR" in decision:
+                elif action == "USE_ITEM_SELECTOR":
                     print("\n----- INVOKING ITEM SELECTOR AGENT -----")
                     
                     # Call the item selector agent to pick a product
@@ -292,51 +490,53 @@ async def simple_supervisor():
                         print(f"Added to cart: {selection_result['cart_added']}")
                     
                     # Wait for page to stabilize after selection
-                    await wait_for_page_with_fallback(page, "networkidle", timeout=10000)
+                    await wait_for_page_with_fallback(page, "domcontentloaded", timeout=10000)
                     
                 # Verify cart contents if goal appears to be achieved or select_item_agent was invoked
-                if select_item_invoked and not on_cart_page and "FINISHED" in decision:
+                if select_item_invoked and not on_cart_page and action == "FINISHED":
                     print("\n----- VERIFYING GOAL ACHIEVEMENT -----")
                     print("Navigating to cart to verify mango product was added...")
+                    idle_frame = None
                     
                     # Navigate to the Amazon cart page
                     try:
-                        await page.goto("https://www.amazon.com/gp/cart/view.html?ref_=nav_cart")
-                        await wait_for_page_with_fallback(page, "networkidle", timeout=10000)
-                        
-                        # Take screenshot of cart
-                        cart_screenshot = await page.screenshot(full_page=True)
-                        cart_screenshot_base64 = base64.b64encode(cart_screenshot).decode("utf-8")
-                        
-                        # Check if cart has mango products
-                        cart_page_content = await page.content()
-                        cart_verification = client.chat.completions.create(
-                            model="gpt-4o",
-                            messages=[
-                                {
-                                    "role": "system",
-                                    "content": "Verify if there are any mango products in this Amazon shopping cart. Answer only YES or NO, followed by a brief explanation."
-                                },
-                                {
-                                    "role": "user",
-                                    "content": [
-                                        {"type": "text", "text": "Does this Amazon cart contain any mango products?"},
-                                        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{cart_screenshot_base64}"}}
-                                    ]
-                            }
-                            ],
-                            max_tokens=100
+                        await page.goto(
+                            "https://www.amazon.com/gp/cart/view.html?ref_=nav_cart",
+                            wait_until="domcontentloaded",
+                            timeout=15000
                         )
                         
-                        cart_check_result = cart_verification.choices[0].message.content
-                        print(f"Cart verification result: {cart_check_result}")
+                        # The in-page cart check usually settles it; only ask the vision
+                        # model when the cart grew but the page text doesn't show mango products
+                        cart_state = await get_cart_state(page)
+                        cart_has_mangos = cart_has_new_mango(cart_state, cart_baseline)
                         
-                        # Check if cart has items (based on both vision model and page content)
-                        cart_has_mangos = "YES" in cart_check_result.upper() or (
-                            "mango" in cart_page_content.lower() and 
-                            not "empty" in cart_page_content.lower() and
-                            not "was removed" in cart_page_content.lower()
-                        )
+                        if cart_has_mangos:
+                            print("Cart page lists mango products, skipping vision check.")
+                        elif not cart_grew(cart_state, cart_baseline):
+                            print(f"Cart count is still {cart_state['cartCount']}; nothing was added this run.")
+                        else:
+                            # Take screenshot of cart
+                            cart_screenshot_url = await capture_screenshot(cdp, page.viewport_size, quality=55, scale=DECISION_SCREENSHOT_SCALE)
+                            
+                            cart_verification = await client.chat.completions.create(
+                                model="gpt-4o",
+                                messages=[
+                                    CART_VERIFY_SYSTEM_MSG,
+                                    {
+                                        "role": "user",
+                                        "content": [
+                                            {"type": "text", "text": "Does this Amazon cart contain any mango products?"},
+                                            {"type": "image_url", "image_url": {"url": cart_screenshot_url}}
+                                        ]
+                                    }
+                                ],
+                                max_tokens=20
+                            )
+                            
+                            cart_check_result = cart_verification.choices[0].message.content
+                            print(f"Cart verification result: {cart_check_result}")
+                            cart_has_mangos = "YES" in cart_check_result.upper()
                         
                         if cart_has_mangos:
                             print("✅ SUCCESS: Mango product confirmed in cart!")
@@ -345,21 +545,24 @@ async def simple_supervisor():
                         else:
                             print("❌ FAILURE: No mango products found in cart!")
                             print("Returning to previous page to try again...")
-                            await page.goto(page_url)  # Return to previous page
-                            await wait_for_page_with_fallback(page, "networkidle", timeout=10000)
+                            # Go back through history to the page we left; load it by URL only if
+                            # there's no history entry. (Playwright launches Chromium with the
+                            # back/forward cache disabled, so this is an ordinary navigation.)
+                            if await page.go_back(wait_until="domcontentloaded") is None:
+                                await page.goto(page_url, wait_until="domcontentloaded", timeout=15000)
                             select_item_invoked = False  # Reset so we can try again
                     except Exception as e:
                         print(f"Error during cart verification: {e}")
                 
-                elif "FINISHED" in decision:
+                elif action == "FINISHED":
                     # Before concluding, verify we have actually added items to cart
                     if not on_cart_page:
                         print("Supervisor believes goal is achieved, but let's verify by checking the cart...")
                         continue  # Continue to next iteration, which will trigger cart verification above
                     else:
                         # We're already on the cart page, so check if it has mango products
-                        cart_page_content = await page.content()
-                        if "mango" in cart_page_content.lower() and not "empty" in cart_page_content.lower():
+                        # (cart_state was read before the decision)
+                        if cart_has_new_mango(cart_state, cart_baseline):
                             print("\n----- GOAL ACHIEVED -----")
                             print("Supervisor confirmed mango products in cart. Goal achieved!")
                             break
@@ -377,55 +580,251 @@ async def simple_supervisor():
                     print("Product page detected - marking item selection step as completed.")
                     select_item_invoked = True
                 
-                # Ask if the user wants to continue or take manual action
-                print("\nContinue to next interaction? Press Enter or type 'exit' to stop:")
-                user_input = await asyncio.get_event_loop().run_in_executor(None, input)
-                if user_input.lower() == "exit":
-                    break
-                
                 # Reset captcha_just_solved if not acted upon (safety mechanism)
                 if captcha_just_solved and interaction_count > 1:
                     captcha_just_solved = False
             
-            # Wait for user to press Enter before closing
-            print("\nWorkflow completed. Press Enter to close the browser...")
-            await asyncio.get_event_loop().run_in_executor(None, input)
+            # Wait for user to press Enter before closing (only when someone is at the terminal)
+            # (Ctrl+C at the prompt goes to the previous handler and aborts as usual)
+            if sys.stdin.isatty() and not stop_requested.is_set():
+                restore_sigint()
+                await ainput("\nWorkflow completed. Press Enter to close the browser...")
             
         except Exception as e:
             print(f"Error in supervisor workflow: {e}")
             # Take error screenshot
-            error_screenshot = await page.screenshot()
-            error_path = "error_screenshot.png"
-            with open(error_path, "wb") as f:
-                f.write(error_screenshot)
+            error_screenshot = await page.screenshot(type="jpeg", quality=60)
+            error_path = "error_screenshot.jpg"
+            await asyncio.to_thread(Path(error_path).write_bytes, error_screenshot)
             print(f"Error screenshot saved to {error_path}")
         
         finally:
-            await browser.close()
+            restore_sigint()
+
+# Playwright driver and browser context shared by every supervisor run in this process
+_PLAYWRIGHT = None
+_BROWSER_CONTEXT = None
+
+async def get_browser_context():
+    """
+    Returns the shared browser context, launching Chromium on first use. The context is
+    persistent, so its profile keeps Amazon cookies between runs and processes, and
+    returning sessions start warm and hit fewer CAPTCHAs.
+    """
+    global _PLAYWRIGHT, _BROWSER_CONTEXT
+    if _BROWSER_CONTEXT is None:
+        _PLAYWRIGHT = await async_playwright().start()
+        _BROWSER_CONTEXT = await _PLAYWRIGHT.chromium.launch_persistent_context(
+            user_data_dir=BROWSER_PROFILE_DIR,
+            headless=False,
+            viewport={"width": 1024, "height": 768},
+            args=["--disable-dev-shm-usage"]
+        )
+    return _BROWSER_CONTEXT
+
+@asynccontextmanager
+async def open_page():
+    """Yields a tab in the shared browser and closes just that tab afterwards."""
+    context = await get_browser_context()
+    # Reuse the blank tab Chromium opens at launch, if it's still there
+    blank_pages = [p for p in context.pages if p.url == "about:blank"]
+    page = blank_pages[0] if blank_pages else await context.new_page()
+    try:
+        yield page
+    finally:
+        await page.close()
+
+async def close_browser() -> None:
+    """Closes the shared browser context and stops Playwright, if they were started."""
+    global _PLAYWRIGHT, _BROWSER_CONTEXT
+    if _BROWSER_CONTEXT is not None:
+        await _BROWSER_CONTEXT.close()
+        _BROWSER_CONTEXT = None
+    if _PLAYWRIGHT is not None:
+        await _PLAYWRIGHT.stop()
+        _PLAYWRIGHT = None
+
+async def run_supervisor() -> None:
+    """Runs the supervisor once, then shuts the shared browser down."""
+    try:
+        await simple_supervisor()
+    finally:
+        await close_browser()
+
+def decide_action(
+    url: str,
+    captcha_detected: bool,
+    cart_state: Optional[Dict[str, Any]],
+    cart_baseline: int,
+    mango_finder_invoked: bool,
+    select_item_invoked: bool
+) -> Optional[str]:
+    """
+    Returns the supervisor action implied by the page state alone, or None when the
+    page is ambiguous and needs the vision model. cart_state is the in-page cart
+    probe result, or None when not on the cart page; cart_baseline is the badge count
+    from before anything was added.
+    """
+    if captcha_detected:
+        return "USE_IMHUMAN"
+    parsed = urlparse(url)
+    if "amazon.com" not in parsed.netloc:
+        return None
+    if "/cart" in parsed.path:
+        if cart_state is not None and cart_has_new_mango(cart_state, cart_baseline):
+            return "FINISHED"
+        return None
+    if "s?k=" in url and not select_item_invoked:
+        return "USE_ITEM_SELECTOR"
+    if parsed.path in ("", "/") and not parsed.query and not mango_finder_invoked:
+        return "USE_MANGO_FINDER"
+    return None
+
+def cart_grew(cart_state: Dict[str, Any], cart_baseline: int) -> bool:
+    """
+    Returns True if the cart badge is above the count read at the start of the run.
+    When either count couldn't be read, the cart is assumed to have grown.
+    """
+    if cart_baseline < 0 or cart_state["cartCount"] < 0:
+        return True
+    return cart_state["cartCount"] > cart_baseline
+
+def cart_has_new_mango(cart_state: Dict[str, Any], cart_baseline: int) -> bool:
+    """
+    Returns True if the cart lists mango products and has grown during this run, so an
+    item left over from an earlier run doesn't count as success.
+    """
+    return cart_state["hasMango"] and not cart_state["cartEmpty"] and cart_grew(cart_state, cart_baseline)
+
+def parse_decision(text: str) -> str:
+    """
+    Returns the action code from the supervisor model's JSON answer. A reported CAPTCHA
+    overrides the action. Other output that isn't valid JSON is returned unchanged, so
+    the action-code substring checks still work on it.
+    """
+    try:
+        parsed = json.loads(text)
+    except (TypeError, ValueError):
+        # Streamed answers are usually cut off mid-object
+        if text and CAPTCHA_PRESENT_RE.search(text):
+            return "USE_IMHUMAN"
+        return text or ""
+    if not isinstance(parsed, dict):
+        return text
+    if parsed.get("captcha_present"):
+        return "USE_IMHUMAN"
+    return str(parsed.get("action", ""))
+
+async def read_until_action(stream) -> str:
+    """
+    Reads a streamed chat completion until the text contains an action code, then
+    closes the stream so the rest of the answer isn't generated or downloaded.
+    """
+    text = ""
+    try:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                text += chunk.choices[0].delta.content
+                if ACTION_RE.search(text):
+                    break
+    finally:
+        await stream.close()
+    return text
+
+def extract_action(decision: str) -> Optional[str]:
+    """Returns the first action code in the decision text, or None if there isn't one."""
+    match = ACTION_RE.search(decision)
+    return match.group(0) if match else None
+
+def detect_captcha(url: str, title: str, flags: Optional[Dict[str, Any]] = None) -> bool:
+    """Decides whether the page is a CAPTCHA from its URL, title and (if given) in-page flags."""
+    return (
+        CAPTCHA_RE.search(url) is not None or
+        CAPTCHA_TITLE_RE.search(title) is not None or
+        (flags is not None and flags["captcha"])
+    )
 
-async def wait_for_page_with_fallback(page, state="networkidle", timeout=5000):
+async def get_page_flags(page) -> Dict[str, Any]:
+    """
+    Returns {"title": str, "captcha": bool, "navLogo": bool, "cartCount": int} for the current page.
+    Falls back to scanning the page HTML if the in-page check fails (e.g. mid-navigation).
+    """
+    try:
+        return await page.evaluate(PAGE_FLAGS_JS)
+    except Exception:
+        page_content = await page.content()
+        return {
+            "title": await page.title(),
+            "captcha": CAPTCHA_RE.search(page_content) is not None,
+            "navLogo": "nav_logo" in page_content,
+            "cartCount": -1
+        }
+
+async def get_cart_state(page) -> Dict[str, Any]:
+    """
+    Returns {"cartCount": int, "hasMango": bool, "cartEmpty": bool} for the cart page.
+    Falls back to scanning the page HTML if the in-page check fails (e.g. mid-navigation).
+    """
+    try:
+        return await page.evaluate(CART_STATE_JS)
+    except Exception:
+        page_content = await page.content()
+        return {
+            "cartCount": -1,
+            "hasMango": MANGO_RE.search(page_content) is not None,
+            "cartEmpty": EMPTY_CART_RE.search(page_content) is not None
+        }
+
+async def ainput(prompt: str = "") -> str:
+    """
+    Reads a line from stdin without blocking the event loop. The loop watches stdin for
+    input instead of parking a worker thread in input(), so Ctrl+C at the prompt cancels
+    the wait right away, and stdin is left open for later prompts in the same process.
+    """
+    loop = asyncio.get_running_loop()
+    fd = sys.stdin.fileno()
+    future = loop.create_future()
+    
+    def on_readable():
+        if not future.done():
+            future.set_result(sys.stdin.readline())
+    
+    try:
+        loop.add_reader(fd, on_readable)
+    except NotImplementedError:
+        # The Windows proactor loop can't watch stdin; fall back to a worker thread
+        return await asyncio.to_thread(input, prompt)
+    
+    try:
+        print(prompt, end="", flush=True)
+        return (await future).rstrip("\n")
+    finally:
+        loop.remove_reader(fd)
+
+async def wait_for_page_with_fallback(page, state="domcontentloaded", timeout=5000, selector=PAGE_LANDMARK_SELECTOR):
     """
     More robust page waiting function that falls back to simpler approaches
-    if the main approach fails.
+    if the main approach fails. After the load state, waits briefly for the
+    selector (by default any Amazon landmark or the CAPTCHA form) instead of sleeping.
     """
     try:
         # Try the requested wait first
         await page.wait_for_load_state(state, timeout=timeout)
-        return True
     except PlaywrightTimeoutError:
-        print(f"Timeout waiting for '{state}'. Trying fallback wait approaches...")
-        
+        print(f"Timeout waiting for '{state}'. Waiting for the document to finish instead...")
         try:
-            # Try waiting for DOMContentLoaded instead
-            await page.wait_for_load_state("domcontentloaded", timeout=5000)
-            print("Page DOM content loaded")
+            await page.wait_for_function("document.readyState === 'complete'", timeout=2000)
         except Exception:
-            # If that fails too, just wait a fixed time
-            print("DOM load timeout. Using fixed delay fallback.")
-            
-        # Fixed delay as final fallback
-        await asyncio.sleep(3)
+            print("Document still loading. Continuing anyway.")
         return False
+    
+    try:
+        # Locator auto-wait polls in the browser and returns as soon as any match is visible
+        await page.locator(selector).first.wait_for(state="visible", timeout=3000)
+    except Exception:
+        # Not every page has a landmark (e.g. the cart while it renders); don't block on it
+        pass
+    return True
 
 if __name__ == "__main__":
-    asyncio.run(simple_supervisor())
+    asyncio.run(run_supervisor())